@@ -23,6 +23,7 @@ setup(name='XenianBot',
           'googletrans',
           'gtts',
           'htmlmin',
+          'httpx',
           'mako',
           'moviepy',
           'mr.developer',
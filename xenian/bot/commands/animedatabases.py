@@ -1,13 +1,16 @@
 import json
 import os
 import re
+import time
 import zipfile
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from functools import lru_cache
 from typing import Any, Callable, Iterable
 
 import requests
-from requests.exceptions import MissingSchema
+from requests.adapters import HTTPAdapter
+from requests.exceptions import MissingSchema, RequestException
 from telegram import Bot, ChatAction, InputFile, InputMediaPhoto, Update
 from telegram.ext import run_async
 
@@ -18,11 +21,31 @@ from xenian.bot.commands.animedatabase_utils.message_queue import MessageQueue
 from xenian.bot.commands.animedatabase_utils.moebooru_service import MoebooruService
 from xenian.bot.commands.animedatabase_utils.post import Post, PostError
 from xenian.bot.settings import ANIME_SERVICES
-from xenian.bot.utils import CustomNamedTemporaryFile, TelegramProgressBar, download_file_from_url_and_upload
+from xenian.bot.utils import MWT, CustomNamedTemporaryFile, TelegramProgressBar, download_file_from_url_and_upload
 from . import BaseCommand
 
 __all__ = ['animedatabases']
 
+TERM_BLACK_LIST = re.compile(r'[^\w_\- +~*:]+')
+TERM_ASCII_BLACK_LIST = {char: None for char in range(128) if not (chr(char).isalnum() or chr(char) in '_- +~*:')}
+
+post_list_cache = MWT(timeout=60)
+
+
+@lru_cache(maxsize=8)
+def get_option_pattern(name: str, is_int: bool):
+    """Get the compiled pattern for an option like "page=2"
+
+    Args:
+        name (:obj:`str`): Name of the option
+        is_int (:obj:`bool`): If the value of the option consists of digits only
+
+    Returns:
+        :obj:`typing.Pattern`: Compiled pattern matching the option with its value in the group "value"
+    """
+    return re.compile(r'{name}[ =:]+(?P<value>{type}+)'.format(name=name, type=r'\d' if is_int else r'\w'),
+                      re.IGNORECASE)
+
 
 class AnimeDatabases(BaseCommand):
     """The class for all danbooru related commands
@@ -32,6 +55,14 @@ class AnimeDatabases(BaseCommand):
     def __init__(self):
         self.files = mongodb_database.files
 
+        # All url checks of all searches share these, so concurrent searches cannot open endless connections
+        self.http_workers = 32
+        self.http_executor = ThreadPoolExecutor(max_workers=self.http_workers)
+        self.http = requests.Session()
+        self.http.headers['User-Agent'] = 'XenianBot'
+        self.http.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=self.http_workers))
+        self.http.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=self.http_workers))
+
         self.services = {}
         self.init_services()
 
@@ -92,12 +123,18 @@ class AnimeDatabases(BaseCommand):
         Returns:
                 :obj:`list`: List with the given strings validated
         """
-        black_list = re.compile('[^\w_\- +~*:]+')
-        terms = map(lambda term: black_list.sub('', term), terms)
-        terms = map(lambda term: term.strip(), terms)
-        terms = map(lambda term: term.replace(' ', '_'), terms)
-        terms = filter(lambda term: not black_list.match(term) and bool(term), terms)
-        return list(OrderedDict.fromkeys(terms))
+        seen = set()
+        filtered_terms = []
+        for term in terms:
+            if term.isascii():
+                term = term.translate(TERM_ASCII_BLACK_LIST)
+            else:
+                term = TERM_BLACK_LIST.sub('', term)
+            term = term.strip().replace(' ', '_')
+            if term and term not in seen:
+                seen.add(term)
+                filtered_terms.append(term)
+        return filtered_terms
 
     def extract_option_from_string(self, name: str, text: str, type_: str or int = None, default: Any = None) -> tuple:
         """Extract option from string
@@ -118,46 +155,107 @@ class AnimeDatabases(BaseCommand):
             return text, bool(default)
 
         type_ = type_ or str
-        options = {
-            'name': name,
-            'type': '\d' if type_ == int else '\w'
-        }
         out = None
 
-        page_pattern = re.compile('{name}[ =:]+{type}+'.format(**options), re.IGNORECASE)
-        match = page_pattern.findall(text)
+        match = get_option_pattern(name, type_ == int).search(text)
         if match:
-            text = page_pattern.sub('', text)
-            out = re.findall('\d+', match[0])[0]
+            text = text[:match.start()] + text[match.end():]
+            out = match.group('value')
             if type_ == int:
-                out = int(re.findall('\d+', match[0])[0])
+                out = int(out)
 
         return text, out if out is not None else default
 
-    def get_image(self, post_id: int, image_url: str = None):
+    def get_cached_image(self, post_id: int) -> str or None:
+        """Get the location of an already saved image if it is still available
+
+        Args:
+            post_id (:obj:`int`): Post id as identification
+
+        Returns:
+            (:obj:`str`): Location of saved file or None if there is no usable one
+        """
+        db_entry = self.files.find_one({'file_id': post_id})
+        if not db_entry:
+            return
+
+        location = db_entry['location']
+        if os.path.isfile(location):
+            return location
+
+        try:
+            response = self.http.head(location, allow_redirects=False, timeout=5)
+            if response.status_code == 200:
+                return location
+        except MissingSchema:
+            # This gets raised when a "location" is a local file but does not exist anymore
+            pass
+        except RequestException:
+            # Uploaded file is unreachable right now, download it again
+            pass
+
+    def get_cached_images(self, post_ids: Iterable[int]) -> dict:
+        """Check the saved images of multiple posts at once
+
+        Args:
+            post_ids (:obj:`Iterable[int]`): Post ids as identification
+
+        Returns:
+            (:obj:`dict`): Post ids mapped to the location of their saved file, posts without one are left out
+        """
+        post_ids = list(post_ids)
+        if not post_ids:
+            return {}
+
+        locations = self.http_executor.map(self.get_cached_image, post_ids)
+        return {post_id: location for post_id, location in zip(post_ids, locations) if location}
+
+    def url_is_available(self, url: str) -> bool:
+        """Check if the file behind the given url can be retrieved
+
+        Args:
+            url (:obj:`str`): Url to the file
+
+        Returns:
+            (:obj:`bool`): True if the file is available
+        """
+        try:
+            return self.http.head(url, allow_redirects=True, timeout=5).ok
+        except RequestException:
+            return False
+
+    def get_available_urls(self, urls: Iterable[str]) -> set:
+        """Check multiple urls at once
+
+        Args:
+            urls (:obj:`Iterable[str]`): Urls to files
+
+        Returns:
+            (:obj:`set`): The urls of the files which are available
+        """
+        urls = set(urls)
+        if not urls:
+            return set()
+
+        availability = self.http_executor.map(self.url_is_available, urls)
+        return {url for url, available in zip(urls, availability) if available}
+
+    def get_image(self, post_id: int, image_url: str = None, check_cache: bool = True):
         """Save image to file and save in db
 
         Args:
             post_id (:obj:`int`): Post od as identification
             image_url (:obj:`str`, optional): Url to image which should be saved
+            check_cache (:obj:`bool`, optional): Return the already saved image if there is a usable one
 
         Returns:
            ( :obj:`str`): Location of saved file
         """
-        db_entry = self.files.find_one({'file_id': post_id})
-        if db_entry:
-            location = db_entry['location']
-            if os.path.isfile(location):
+        if check_cache:
+            location = self.get_cached_image(post_id)
+            if location:
                 return location
 
-            try:
-                response = requests.head(location)
-                if response.status_code == 200:
-                    return location
-            except MissingSchema:
-                # This gets raised when a "location" is a local file but does not exist anymore
-                pass
-
         if not image_url:
             return
 
@@ -167,6 +265,20 @@ class AnimeDatabases(BaseCommand):
                           upsert=True)
         return downloaded_image_location
 
+    @post_list_cache
+    def get_posts(self, service: BaseService, **query) -> list:
+        """Get posts from the api of the given service, same queries are cached for a minute
+
+        Args:
+            service (:obj:`BaseService`): Initialized :obj:`BaseService` for the various api calls
+            **query (:obj:`dict`): Query with keywords for the post_list of the service
+
+        Returns:
+            (:obj:`list`): List of post dicts
+        """
+        post_list_cache.collect()
+        return service.client.post_list(**query)
+
     @run_async
     def search(self, bot: Bot, update: Update, service: BaseService, args: list = None):
         """Generic search based on :class:`BaseService`
@@ -299,11 +411,16 @@ class AnimeDatabases(BaseCommand):
 
     # Danbooru API commands
 
-    def danbooru_get_image(self, post: dict, service: DanbooruService) -> Post:
+    def danbooru_get_image(self, post: dict, service: DanbooruService, cached_images: dict = None) -> Post:
         image_url = post.get('large_file_url', None)
         post_url = '{domain}/posts/{post_id}'.format(domain=service.url, post_id=post['id'])
 
-        image_url = self.get_image(post['id'], image_url) or image_url
+        if cached_images is None:
+            image_url = self.get_image(post['id'], image_url) or image_url
+        else:
+            image_url = (cached_images.get(post['id'])
+                         or self.get_image(post['id'], image_url, check_cache=False)
+                         or image_url)
 
         if not image_url and service.session:
             response = service.session.get(post_url)
@@ -330,7 +447,7 @@ class AnimeDatabases(BaseCommand):
             group_size (:obj:`bool`): If the found items shall be grouped to a media group
         """
         message = update.message
-        posts = service.client.post_list(**query)
+        posts = self.get_posts(service, **query)
 
         if not posts:
             message.reply_text('Nothing found on page {page}'.format(**query))
@@ -344,12 +461,14 @@ class AnimeDatabases(BaseCommand):
         )
 
         message_queue = MessageQueue(total=len(posts), message=message, group_size=group_size)
+        cached_images = self.get_cached_images(post['id'] for post in posts)
 
         parsed_posts = []
         group = []
-        for index, post_dict in progress_bar.enumerate(posts):
+        last_chat_action = float('-inf')
+        for post_dict in progress_bar(posts):
             try:
-                post = self.danbooru_get_image(post=post_dict, service=service)
+                post = self.danbooru_get_image(post=post_dict, service=service, cached_images=cached_images)
                 parsed_posts.append(post)
             except PostError as error:
                 message_queue.report(error)
@@ -362,13 +481,16 @@ class AnimeDatabases(BaseCommand):
                 if post.is_video():
                     message_queue.report(PostError(code=PostError.WRONG_FILE_TYPE, post=post))
                     continue
-                if index and index % group_size == 0:
+                group.append(post.telegram)
+                if len(group) == group_size:
                     self.send_group(group=group, bot=bot, update=update, queue=message_queue)
                     group = []
-                group.append(post.telegram)
                 continue
 
-            bot.send_chat_action(chat_id=message.chat_id, action=ChatAction.UPLOAD_PHOTO)
+            # Telegram shows a chat action for about 5 seconds, so there is no need to send it for every image
+            if time.monotonic() - last_chat_action > 4:
+                bot.send_chat_action(chat_id=message.chat_id, action=ChatAction.UPLOAD_PHOTO)
+                last_chat_action = time.monotonic()
             self.send_image(update=update, image=post.telegram, queue=message_queue)
 
         if zip_it:
@@ -392,7 +514,7 @@ class AnimeDatabases(BaseCommand):
     def moebooru_real_search(self, bot: Bot, update: Update, service: MoebooruService, query: dict,
                              group_size: bool = False, zip_it: bool = False):
         message = update.message
-        posts = service.client.post_list(**query)
+        posts = self.get_posts(service, **query)
 
         if not posts:
             message.reply_text('Nothing found on page {page}'.format(**query))
@@ -407,23 +529,32 @@ class AnimeDatabases(BaseCommand):
 
         message_queue = MessageQueue(total=len(posts), message=message, group_size=group_size)
 
+        available_urls = set()
+        if not zip_it:
+            # Telegram fetches the files itself, so broken ones are sorted out before they fail a whole group
+            available_urls = self.get_available_urls(post['file_url'] for post in posts)
+
         group = []
         parsed_posts = []
-        for index, post_dict in progress_bar.enumerate(posts):
+        for post_dict in progress_bar(posts):
             post = self.moebooru_get_image(post=post_dict, service=service, download=zip_it)
             parsed_posts.append(post)
 
             if zip_it:
                 continue
 
+            if post.media not in available_urls:
+                message_queue.report(PostError(code=PostError.IMAGE_NOT_FOUND, post=post))
+                continue
+
             if group_size:
                 if post.is_video():
                     message_queue.report(PostError(code=PostError.WRONG_FILE_TYPE, post=post))
                     continue
-                if index and index % group_size == 0:
+                group.append(post.telegram)
+                if len(group) == group_size:
                     self.send_group(group=group, bot=bot, update=update, queue=message_queue)
                     group = []
-                group.append(post.telegram)
                 continue
             else:
                 self.send_image(update=update, image=post.telegram, queue=message_queue)
@@ -5,6 +5,7 @@ from PIL import Image
 from pytesseract import TesseractError
 from telegram import Bot, ParseMode, Update
 from telegram.ext import run_async
+from telegram.utils.helpers import escape_markdown
 
 from xenian.bot.settings import IMAGE_TO_TEXT_LANG
 from xenian.bot.utils import get_option_from_string
@@ -88,7 +89,7 @@ class ImageToText(BaseCommand):
                                           'See all languages with /itt_lang.')
 
         if text:
-            reply = '*This text was found:*\n\n{}'.format(text)
+            reply = '*This text was found:*\n\n{}'.format(escape_markdown(text))
         else:
             reply = 'No text was found. Make sure that the text is not rotated and good readable.'
 
@@ -123,10 +124,13 @@ class ImageToText(BaseCommand):
 
         if text:
             translated = translate.translate_text(text, lang_to=lang_to)
+            if not translated:
+                update.message.reply_text('Google Translate is not available right now, try again later.')
+                return
             reply = '*Found Text:*\n{text}\n\n*Translation:* `{direction}` \n\n{translated}'.format(
-                text=translated.orign,
+                text=escape_markdown(translated.origin),
                 direction=f'{translated.src} -> {translated.dest}',
-                translated=translated.text
+                translated=escape_markdown(translated.text)
             )
         else:
             reply = 'No text was found. Make sure that the text is not rotated and good readable.'
@@ -1,9 +1,14 @@
+from functools import lru_cache
+from threading import Thread
+
+import httpx
 from googletrans import Translator
 from googletrans.constants import LANGUAGES
 from googletrans.models import Translated
 from telegram import Bot, Update
 from telegram.ext import run_async
 from telegram.parsemode import ParseMode
+from telegram.utils.helpers import escape_markdown
 
 from xenian.bot.utils import get_option_from_string
 from .base import BaseCommand
@@ -31,10 +36,36 @@ class Translate(BaseCommand):
             },
         ]
 
-        self.translator = Translator()
+        # Raise on failed requests, so that only real translations end up in the cache of cached_translate
+        self.translator = Translator(raise_exception=True)
+        self.init_http_client()
+        Thread(target=self.warm_up, daemon=True).start()
 
         super(Translate, self).__init__()
 
+    def init_http_client(self):
+        """Give the translator a client which keeps more connections alive
+
+        httpx only keeps 10 connections alive by default, concurrent translations above that would have to do a new
+        handshake each time.
+        """
+        client = httpx.Client(
+            headers=self.translator.client.headers,
+            pool_limits=httpx.PoolLimits(max_keepalive=50, max_connections=100),
+        )
+        self.translator.client.close()
+        self.translator.client = client
+        self.translator.token_acquirer.client = client
+
+    def warm_up(self):
+        """Fetch Google's translation token ahead of time so the first translation does not have to
+        """
+        try:
+            self.translator.translate('hi', dest='en')
+        except Exception:
+            # Not being able to warm up is no reason to fail, the token is fetched again on the next translation
+            pass
+
     @run_async
     def translate(self, bot: Bot, update: Update):
         """Translate the given text
@@ -81,11 +112,11 @@ class Translate(BaseCommand):
             return
 
         translated = self.translate_text(primary_text, translate_from, translate_to)
+        if not translated:
+            update.message.reply_text('Google Translate is not available right now, try again later.')
+            return
 
-        reply = '*TRANSLATION*: `{direction}`\n\n{translate_text}'.format(
-            direction=f'{translated.src} -> {translated.dest}',
-            translate_text=translated.text,
-        )
+        reply = f'*TRANSLATION*: `{translated.src} -> {translated.dest}`\n\n{escape_markdown(translated.text)}'
         update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN)
 
     def translate_text(self, text: str, lang_from: str = None, lang_to: str = None) -> Translated:
@@ -96,18 +127,30 @@ class Translate(BaseCommand):
             lang_from (:obj:`str`): Language to translate from
             lang_to (:obj:`str`): Language to translate to
 
+        Returns:
+            :obj:`googletrans.models.Translated`: Translated text or None if Google did not answer properly
+        """
+        try:
+            return self.cached_translate(text, lang_from or 'auto', lang_to or 'en')
+        except Exception as error:
+            # googletrans only raises a bare Exception when Google answers with an error status (e.g. rate limit)
+            if type(error) is Exception and str(error).startswith('Unexpected status code'):
+                return
+            raise
+
+    @lru_cache(maxsize=1024)
+    def cached_translate(self, text: str, lang_from: str, lang_to: str) -> Translated:
+        """Translate text and remember the result for the same text and languages
+
+        Args:
+            text (:obj:`str`): Text to translate
+            lang_from (:obj:`str`): Language to translate from or "auto" to detect it
+            lang_to (:obj:`str`): Language to translate to
+
         Returns:
             :obj:`googletrans.models.Translated`: Translated text
         """
-        direction = 'en'
-        if lang_from and not lang_to:
-            direction = '{}-en'.format(lang_from)
-        elif lang_from and lang_to:
-            direction = '{}-{}'.format(lang_from, lang_to)
-        elif not lang_from and lang_to:
-            direction = lang_to
-
-        return self.translator.translate(text, direction)
+        return self.translator.translate(text, dest=lang_to, src=lang_from)
 
 
 translate = Translate()
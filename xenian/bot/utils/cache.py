@@ -16,12 +16,10 @@ class MWT(object):
 
     def collect(self):
         """Clear cache of results which have timed out"""
-        for func in self._caches:
-            cache = {}
-            for key in self._caches[func]:
-                if (time.time() - self._caches[func][key][1]) < self._timeouts[func]:
-                    cache[key] = self._caches[func][key]
-            self._caches[func] = cache
+        for func, cache in self._caches.items():
+            for key, value in list(cache.items()):
+                if (time.time() - value[1]) >= self._timeouts[func]:
+                    cache.pop(key, None)
 
     def __call__(self, f):
         self.cache = self._caches[f] = {}